@@ -8,35 +8,101 @@ import subprocess
 from zipfile import ZipFile
 import gzip
 import shutil
+import tempfile
 from itertools import islice
 from six.moves import urllib
 
 
-def run_pipeline(file, genome, outdir, name, layout, platform, model, download_link):
-    # create the output folder
+# rough upper bound of the scratch space used by one run, relative to the size
+# of the SRA file (fastq and trimmed fastq, then sam and bam for each genome),
+# and by the index of a genome, relative to the size of the genome
+SCRATCH_READS_FACTOR = 8
+SCRATCH_ALIGN_FACTOR = 12
+SCRATCH_GENOME_FACTOR = 3
+
+
+def run_pipeline(file, genomes, index_prefixes, outdir, name, layout, platform, model, download_link, scratch=None, output_format='bam', genome_outdirs=None):
+    # the outputs of reads preparation are put in outdir, the alignments
+    # against each genome in genome_outdirs (the same as outdir if not specified)
+    if genome_outdirs is None:
+        genome_outdirs = [outdir] * len(genomes)
+    # create the output folders
     output_prefix = path.join(outdir, name)
     os.mkdir(output_prefix)
+    genome_prefixes = [path.join(d, name) for d in genome_outdirs]
+    for genome_prefix in genome_prefixes:
+        if not path.exists(genome_prefix):
+            os.mkdir(genome_prefix)
 
     if platform == 'ABI_SOLID':
-        return (
+        return [(
             False,
-            'Currently, the colorspace data from ABI_SOLID is not supported')
-
-    # decompress the gz file, becasue some of tools don't accept .gz compressed files
-    if genome.endswith('.gz'):
-        new_genome_file_name = path.join(output_prefix,
-                                         path.basename(genome).rstrip('.gz'))
-        with gzip.open(genome, 'rb') as f_in:
-            with open(new_genome_file_name, 'wb') as f_out:
-                shutil.copyfileobj(f_in, f_out)
-        genome = new_genome_file_name
-    sra_file_name = path.basename(file)
-    genome_file_name = path.basename(genome)
+            'Currently, the colorspace data from ABI_SOLID is not supported')] * len(genomes)
 
     # check if SRA file exist or download it first
     if not path.exists(file):
         urllib.request.urlretrieve(download_link, file)
 
+    if scratch is None:
+        return process_run(file, genomes, index_prefixes, output_prefix,
+                           genome_prefixes, layout, platform, model,
+                           output_format)
+
+    # the size of the SRA file is needed to estimate the space
+    if not check_scratch_space(scratch, file, genomes):
+        return [(
+            False,
+            "scratch folder {} doesn't have enough free space for run {}. It's not processed.".format(scratch, name))] * len(genomes)
+    # run all the steps in a folder on the scratch, then only publish the final outputs
+    work_prefix = tempfile.mkdtemp(prefix=name + '.', dir=scratch)
+    work_genome_prefixes = []
+    for ind, genome_prefix in enumerate(genome_prefixes):
+        if genome_prefix == output_prefix:
+            work_genome_prefixes.append(work_prefix)
+        else:
+            work_genome_prefixes.append(
+                path.join(work_prefix, 'genome_{}'.format(ind)))
+            os.mkdir(work_genome_prefixes[-1])
+    prefixes = [(work_prefix, output_prefix)]
+    prefixes += [(src_prefix, dst_prefix) for src_prefix, dst_prefix in zip(
+        work_genome_prefixes, genome_prefixes) if src_prefix != work_prefix]
+    results = None
+    try:
+        results = process_run(file, genomes, index_prefixes, work_prefix,
+                              work_genome_prefixes, layout, platform, model,
+                              output_format)
+    finally:
+        try:
+            for src_prefix, dst_prefix in prefixes:
+                for file_name in os.listdir(src_prefix):
+                    # keep only the logs if one of the steps raised an error
+                    if is_published_output(file_name) and (
+                            results is not None or is_log(file_name)):
+                        publish_output(
+                            path.join(src_prefix, file_name),
+                            path.join(dst_prefix, file_name))
+        finally:
+            shutil.rmtree(work_prefix)
+    return results
+
+
+def process_run(file, genomes, index_prefixes, output_prefix, genome_prefixes, layout, platform, model, output_format='bam'):
+    # prepare the reads once, then align them to each genome
+    return_status, err_message = prepare_reads(file, output_prefix, layout,
+                                               platform, model)
+    if not return_status:
+        return [(return_status, err_message)] * len(genomes)
+    return [
+        align_reads(file, genome, index_prefix, output_prefix, genome_prefix,
+                    layout, output_format)
+        for genome, index_prefix, genome_prefix in zip(
+            genomes, index_prefixes, genome_prefixes)
+    ]
+
+
+def prepare_reads(file, output_prefix, layout, platform, model):
+    sra_file_name = path.basename(file)
+
     # convert SRA file to fastq file(s)
     print('Unpacking the SRA file: {} ...'.format(file))
     f_stdout = open(
@@ -63,7 +129,6 @@ def run_pipeline(file, genome, outdir, name, layout, platform, model, download_l
 
     # Run FastQC first
     # Then, use Trimmomatic to do trimming
-    # In the last step, perfom the alignment using HISAT2
     fastqc_path = get_fastqc_path()
     trimmomatic_jar_path = get_trimmomatic_jar_path()
     if layout == 'SINGLE':
@@ -132,29 +197,6 @@ def run_pipeline(file, genome, outdir, name, layout, platform, model, download_l
                 stderr=f_stderr)
         f_stdout.close()
         f_stderr.close()
-        print('Aligning ...')
-        f_stdout = open(
-            path.join(output_prefix, sra_file_name + '.hisat2.log'), 'w')
-        f_stderr = open(
-            path.join(output_prefix, sra_file_name + '.hisat2.errlog'), 'w')
-        subprocess.run(
-            [
-                get_hisat2_command_path('hisat2-build'), genome,
-                path.join(output_prefix, genome_file_name)
-            ],
-            stdout=f_stdout,
-            stderr=f_stderr)
-        subprocess.run(
-            [
-                get_hisat2_command_path('hisat2'), '-x',
-                path.join(output_prefix, genome_file_name), '-U',
-                path.join(output_prefix, 'output.fastq'), '-S',
-                path.join(output_prefix, 'output.sam')
-            ],
-            stdout=f_stdout,
-            stderr=f_stderr)
-        f_stdout.close()
-        f_stderr.close()
     elif layout == 'PAIRED':
         print('QC ...')
         f_stdout = open(
@@ -265,77 +307,226 @@ def run_pipeline(file, genome, outdir, name, layout, platform, model, download_l
                 stderr=f_stderr)
         f_stdout.close()
         f_stderr.close()
-        print('Aligning ...')
+    return (True, '')
+
+
+def build_index(genome, index_dir, log_dir):
+    # build the HISAT2 index of the genome once, it's shared by all the runs
+    index_prefix = path.join(index_dir, path.basename(genome))
+    print('Building the index of {} ...'.format(path.basename(genome)))
+    f_stdout = open(path.join(log_dir, 'hisat2-build.log'), 'w')
+    f_stderr = open(path.join(log_dir, 'hisat2-build.errlog'), 'w')
+    subprocess.run(
+        [get_hisat2_command_path('hisat2-build'), genome, index_prefix],
+        stdout=f_stdout,
+        stderr=f_stderr)
+    f_stdout.close()
+    f_stderr.close()
+    return index_prefix
+
+
+def align_reads(file, genome, index_prefix, reads_prefix, output_prefix, layout, output_format='bam'):
+    sra_file_name = path.basename(file)
+
+    # perfom the alignment of the trimmed reads using HISAT2
+    if layout == 'SINGLE':
+        print('Aligning to {} ...'.format(path.basename(genome)))
         f_stdout = open(
-            path.join(output_prefix, sra_file_name + '.hisat2-build.log'), 'w')
+            path.join(output_prefix, sra_file_name + '.hisat2.log'), 'w')
         f_stderr = open(
-            path.join(output_prefix, sra_file_name + '.hisat2-build.errlog'),
-            'w')
+            path.join(output_prefix, sra_file_name + '.hisat2.errlog'), 'w')
         subprocess.run(
             [
-                get_hisat2_command_path('hisat2-build'), genome,
-                path.join(output_prefix, genome_file_name)
+                get_hisat2_command_path('hisat2'), '-x', index_prefix, '-U',
+                path.join(reads_prefix, 'output.fastq'), '-S',
+                path.join(output_prefix, 'output.sam')
             ],
             stdout=f_stdout,
             stderr=f_stderr)
         f_stdout.close()
         f_stderr.close()
+    elif layout == 'PAIRED':
+        print('Aligning to {} ...'.format(path.basename(genome)))
         f_stdout = open(
             path.join(output_prefix, sra_file_name + '.hisat2.log'), 'w')
         f_stderr = open(
             path.join(output_prefix, sra_file_name + '.hisat2.errlog'), 'w')
         subprocess.run(
             [
-                get_hisat2_command_path('hisat2'), '-x',
-                path.join(output_prefix, genome_file_name), '-1',
-                path.join(output_prefix, 'output_1.fastq'), '-2',
-                path.join(output_prefix, 'output_2.fastq'), '-S',
+                get_hisat2_command_path('hisat2'), '-x', index_prefix, '-1',
+                path.join(reads_prefix, 'output_1.fastq'), '-2',
+                path.join(reads_prefix, 'output_2.fastq'), '-S',
                 path.join(output_prefix, 'output.sam')
             ],
             stdout=f_stdout,
             stderr=f_stderr)
         f_stdout.close()
         f_stderr.close()
-    # sort and convert to the bam file
+    # sort and convert to the bam (or cram) file
+    output_file = path.join(output_prefix, 'output.' + output_format)
     f_stdout = open(
         path.join(output_prefix, sra_file_name + '.samtools.log'), 'w')
     f_stderr = open(
         path.join(output_prefix, sra_file_name + '.samtools.errlog'), 'w')
-    subprocess.run(
-        [
-            'samtools', 'sort', '-o',
-            path.join(output_prefix, 'output.bam'), '-O', 'bam', '-T',
-            path.join(output_prefix, 'output'),
-            path.join(output_prefix, 'output.sam')
-        ],
-        stdout=f_stdout,
-        stderr=f_stderr)
+    if output_format == 'cram':
+        # compress against the genome, then build the .crai index
+        sort_process = subprocess.run(
+            [
+                'samtools', 'sort', '-o', output_file, '-O', 'cram',
+                '--reference', genome, '-T',
+                path.join(output_prefix, 'output'),
+                path.join(output_prefix, 'output.sam')
+            ],
+            stdout=f_stdout,
+            stderr=f_stderr)
+        if sort_process.returncode == 0:
+            subprocess.run(
+                ['samtools', 'index', output_file],
+                stdout=f_stdout,
+                stderr=f_stderr)
+    else:
+        sort_process = subprocess.run(
+            [
+                'samtools', 'sort', '-o', output_file, '-O', 'bam', '-T',
+                path.join(output_prefix, 'output'),
+                path.join(output_prefix, 'output.sam')
+            ],
+            stdout=f_stdout,
+            stderr=f_stderr)
     f_stdout.close()
     f_stderr.close()
+    if sort_process.returncode != 0 or not path.exists(output_file):
+        return (
+            False,
+            "samtools failed to sort {}. It's not processed.".format(
+                path.join(output_prefix, 'output.sam')))
+    if output_format == 'cram' and not check_cram_md5(output_file, genome):
+        return (
+            False,
+            "The reference MD5s of {} don't match the genome. It's not processed.".format(output_file))
     return (True, '')
 
 
-def merge_files(files, outdir):  # merge sam files
+def merge_files(files, outdir, genome=None, output_format='bam'):  # merge sam files
     print('Combing the sam/bam files ...')
+    output_file = path.join(outdir, 'output.' + output_format)
     f_stdout = open(path.join(outdir, 'out.log'), 'a')
     f_stderr = open(path.join(outdir, 'out.errlog'), 'a')
     args = [
         'java', '-jar',
         get_picard_jar_path(), 'MergeSamFiles',
-        'O=' + path.join(outdir, 'output.bam')
+        'O=' + output_file
     ]
+    if output_format == 'cram':
+        args.append('R=' + genome)
     args += ['I=' + f for f in files]
     subprocess.run(args, stdout=f_stdout, stderr=f_stderr)
+    if output_format == 'cram':
+        subprocess.run(
+            ['samtools', 'index', output_file],
+            stdout=f_stdout,
+            stderr=f_stderr)
     print('Finished combining the sam/bam files')
 
 
+def get_genome_name(genome):
+    file_name = path.basename(genome)
+    if file_name.endswith('.gz'):
+        file_name = file_name[:-len('.gz')]
+    return path.splitext(file_name)[0]
+
+
+def check_scratch_space(scratch, file, genomes):
+    # the indexes are built once before the runs, so only the reads and alignments count
+    required = (SCRATCH_READS_FACTOR * path.getsize(file) +
+                SCRATCH_ALIGN_FACTOR * path.getsize(file) * len(genomes))
+    return shutil.disk_usage(scratch).free >= required
+
+
+def check_index_space(scratch, genome):
+    return shutil.disk_usage(scratch).free >= SCRATCH_GENOME_FACTOR * path.getsize(genome)
+
+
+def is_log(file_name):
+    return file_name.endswith('.log') or file_name.endswith('.errlog')
+
+
+def is_published_output(file_name):
+    # run bam, QC summaries of FastQC and logs
+    return (file_name in ['output.bam', 'output.cram', 'output.cram.crai']
+            or '_fastqc' in file_name or is_log(file_name))
+
+
+def publish_output(src, dst):
+    # copy to a temporary name first, so an incomplete file never appears in the output folder
+    temp_dst = dst + '.part'
+    if path.isdir(src):
+        shutil.copytree(src, temp_dst)
+    else:
+        shutil.copyfile(src, temp_dst)
+    os.rename(temp_dst, dst)
+
+
+def get_dict_path(ref_path):
+    file_prefix, _ = path.splitext(ref_path)
+    return file_prefix + '.dict'
+
+
 def check_ref_files(ref_path):
-    if path.exists(ref_path + '.fai') and path.exists('.dict'):
+    if path.exists(ref_path + '.fai') and path.exists(get_dict_path(ref_path)):
         return True
     else:
         return False
 
 
+def prepare_ref_files(ref_path):
+    if not check_ref_files(ref_path):
+        print('Creating sequence directory')
+        # create the picard dict and samtools index
+        if not path.exists(get_dict_path(ref_path)):
+            subprocess.run([
+                'java', '-jar', get_picard_jar_path(), 'CreateSequenceDictionary',
+                'R=' + ref_path, 'O=' + get_dict_path(ref_path)
+            ])
+        print('Creating the index')
+        subprocess.run(['samtools', 'faidx', ref_path])
+
+
+def read_header_md5s(lines):
+    # read the MD5 (M5 tag) of each sequence from the sam header lines
+    md5s = {}
+    for line in lines:
+        if not line.startswith('@SQ'):
+            continue
+        tags = dict(
+            tag.split(':', 1) for tag in line.rstrip('\n').split('\t')[1:])
+        if 'SN' in tags and 'M5' in tags:
+            md5s[tags['SN']] = tags['M5']
+    return md5s
+
+
+def check_cram_md5(cram_path, ref_path):
+    # compare the MD5s in the cram header with the ones in the genome's dict
+    header = subprocess.run(
+        ['samtools', 'view', '-H', cram_path],
+        stdout=subprocess.PIPE,
+        universal_newlines=True).stdout
+    cram_md5s = read_header_md5s(header.splitlines())
+    with open(get_dict_path(ref_path)) as f:
+        ref_md5s = read_header_md5s(f)
+    return compare_md5s(cram_md5s, ref_md5s)
+
+
+def compare_md5s(cram_md5s, ref_md5s):
+    # every sequence in the cram header should have the MD5 of the genome
+    if len(cram_md5s) == 0:
+        return False
+    for name, md5 in cram_md5s.items():
+        if ref_md5s.get(name) != md5:
+            return False
+    return True
+
+
 def read_sam_errors(file_path):
     warns = set()
     errors = set()
@@ -351,152 +542,216 @@ def read_sam_errors(file_path):
     return (errors, warns)
 
 
-if __name__ == '__main__':
-    # parse the arguments, exclude the script name
-    args = parse_args(argv[1:])
-
-    # convert many arguments to absolute path
-    if not path.isabs(args.outdir):
-        args.outdir = path.abspath(args.outdir)
-    if not path.isabs(args.input):
-        args.input = path.abspath(args.input)
-    if not path.isabs(args.genome):
-        args.genome = path.abspath(args.genome)
-
-    os.mkdir(path.join(args.outdir, args.name))
-    if args.genome.endswith('.gz'):
-        new_genome_file_name = path.join(
-            args.outdir, args.name,
-            path.basename(args.genome).rstrip('.gz'))
-        with gzip.open(args.genome, 'rb') as f_in:
-            with open(new_genome_file_name, 'wb') as f_out:
-                shutil.copyfileobj(f_in, f_out)
-        args.genome = new_genome_file_name
-
-    with open(args.input) as f:
-        col_names = f.readline().rstrip('\n').split('\t')
-        run_ind = col_names.index('Run')
-        platform_ind = col_names.index('Platform')
-        model_ind = col_names.index('Model')
-        layout_ind = col_names.index('LibraryLayout')
-        download_ind = col_names.index('download_path')
-        print('Checking the input tsv file: {}'.format(args.input))
-        for ind, name in zip([run_ind, platform_ind, model_ind, layout_ind, download_ind],
-                             ['Run', 'Platform', 'Model', 'LibraryLayout', 'download_path']):
-            if ind == -1:
-                print('{} column is missing in input tsv file.'.format(name))
-                exit(1)
-        runs = []
-        platforms = []
-        models = []
-        layouts = []
-        download_links = []
-        for line in f:
-            temp = line.rstrip('\n').split('\t')
-            runs.append(temp[run_ind])
-            platforms.append(temp[platform_ind])
-            models.append(temp[model_ind])
-            layouts.append(temp[layout_ind])
-            download_links.append(temp[download_ind])
-    files_for_merge = []
-    for run, platform, model, layout, download_link in zip(runs, platforms, models, layouts, download_links):
-        print('Processing the file: {}'.format(run))
-        if not path.isabs(run):
-            run = path.abspath(run)
-        run_file_name = path.basename(run)
-        return_status, err_message = run_pipeline(
-            file=run,
-            genome=args.genome,
-            outdir=path.join(args.outdir, args.name),
-            name=run_file_name,
-            layout=layout,
-            platform=platform,
-            model=model,
-            download_link=download_link
-            )
-        if return_status:
-            files_for_merge.append(
-                path.join(args.outdir, args.name, run_file_name, 'output.bam'))
-        else:
-            print(err_message)
-    # combine the sam files together and convert to BAM file
-    merge_files(files_for_merge, path.join(args.outdir, args.name))
-    # handle the downsample
-    if args.downsample:
-        if not check_ref_files(args.genome):
-            print('Creating sequence directory')
-            # create the picard dict and samtools index
-            file_prefix, _ = path.splitext(args.genome)
-            subprocess.run([
-                'java', '-jar', get_picard_jar_path(), 'CreateSequenceDictionary',
-                'R=' + args.genome, 'O=' + file_prefix + '.dict'
-            ])
-            print('Creating the index')
-            subprocess.run(['samtools', 'faidx', args.genome])
-        print('Validating the sam/bam file ...')
-        f_stdout = open(
-            path.join(args.outdir, args.name, 'check_bam.log'), 'w')
-        f_stderr = open(
-            path.join(args.outdir, args.name, 'check_bam.errlog'), 'w')
+def downsample_file(outdir, genome, output_format='bam'):
+    merged_file = path.join(outdir, 'output.' + output_format)
+    prepare_ref_files(genome)
+    print('Validating the sam/bam file ...')
+    f_stdout = open(path.join(outdir, 'check_bam.log'), 'w')
+    f_stderr = open(path.join(outdir, 'check_bam.errlog'), 'w')
+    subprocess.run(
+        [
+            'java', '-jar', get_picard_jar_path(), 'ValidateSamFile',
+            'I=' + merged_file,
+            'O=' + path.join(outdir, 'validatesam.log'),
+            'R=' + genome,
+            'MAX_RECORDS_IN_RAM=50000',
+            'MODE=SUMMARY'
+        ],
+        stdout=f_stdout,
+        stderr=f_stderr)
+    errors, _ = read_sam_errors(path.join(outdir, 'validatesam.log'))
+    # fix missing read groups error
+    if 'MISSING_READ_GROUP' in errors:
+        f_stdout = open(path.join(outdir, 'fix_missing_read_group.log'), 'w')
+        f_stderr = open(path.join(outdir, 'fix_missing_read_group.errlog'), 'w')
         subprocess.run(
             [
-                'java', '-jar', get_picard_jar_path(), 'ValidateSamFile',
-                'I=' + path.join(args.outdir, args.name, 'output.bam'),
-                'O=' + path.join(args.outdir, args.name, 'validatesam.log'),
-                'MAX_RECORDS_IN_RAM=50000',
-                'MODE=SUMMARY'
+                'java', '-jar', get_picard_jar_path(),
+                'AddOrReplaceReadGroups',
+                'I=' + merged_file,
+                # keep the extension, picard chooses the output format with it
+                'O=' + path.join(outdir, 'output.temp.' + output_format),
+                'R=' + genome,
+                'RGID=' + path.basename(merged_file), # read group id is file name
+                'RGLB=unknown', 'RGPL=unknown', 'RGPU=unknown', 'RGSM=unknown',
+                'MAX_RECORDS_IN_RAM=50000'
             ],
             stdout=f_stdout,
+            stderr=f_stderr
+            )
+        os.remove(merged_file)
+        os.rename(path.join(outdir, 'output.temp.' + output_format), merged_file)
+    # TODO: handle other errors and warnings
+    print('Start downsampling ...')
+    f_stdout = open(path.join(outdir, 'build_bam_index.log'), 'w')
+    f_stderr = open(path.join(outdir, 'build_bam_index.errlog'), 'w')
+    if output_format == 'cram':
+        subprocess.run(
+            ['samtools', 'index', merged_file],
+            stdout=f_stdout,
             stderr=f_stderr)
-        errors, _ = read_sam_errors(
-            path.join(args.outdir, args.name, 'validatesam.log'))
-        # fix missing read groups error
-        if 'MISSING_READ_GROUP' in errors:
-            f_stdout = open(
-                path.join(args.outdir, args.name, 'fix_missing_read_group.log'), 'w')
-            f_stderr = open(
-                path.join(args.outdir, args.name, 'fix_missing_read_group.errlog'), 'w')
-            subprocess.run(
-                [
-                    'java', '-jar', get_picard_jar_path(),
-                    'AddOrReplaceReadGroups',
-                    'I=' + path.join(args.outdir, args.name, 'output.bam'),
-                    'O=' + path.join(args.outdir, args.name, 'output.bam.temp'),
-                    'RGID=output.bam', # read group id is file name
-                    'RGLB=unknown', 'RGPL=unknown', 'RGPU=unknown', 'RGSM=unknown',
-                    'MAX_RECORDS_IN_RAM=50000'
-                ],
-                stdout=f_stdout,
-                stderr=f_stderr
-                )
-            os.remove(path.join(args.outdir, args.name, 'output.bam'))
-            os.rename(path.join(args.outdir, args.name, 'output.bam.temp'), path.join(args.outdir, args.name, 'output.bam'))
-        # TODO: handle other errors and warnings
-        print('Start downsampling ...')
-        f_stdout = open(
-            path.join(args.outdir, args.name, 'build_bam_index.log'), 'w')
-        f_stderr = open(
-            path.join(args.outdir, args.name, 'build_bam_index.errlog'), 'w')
+    else:
         subprocess.run(
             [
                 'java', '-jar',
                 get_picard_jar_path(), 'BuildBamIndex',
-                'I=' + path.join(args.outdir, args.name, 'output.bam')
+                'I=' + merged_file
             ],
             stdout=f_stdout,
             stderr=f_stderr)
-        f_stdout = open(
-            path.join(args.outdir, args.name, 'reduce_coverage.log'), 'w')
-        f_stderr = open(
-            path.join(args.outdir, args.name, 'reduce_coverage.errlog'), 'w')
+    f_stdout = open(path.join(outdir, 'reduce_coverage.log'), 'w')
+    f_stderr = open(path.join(outdir, 'reduce_coverage.errlog'), 'w')
+    # GATK 3 only writes bam files, so a cram file is converted from a temporary bam file
+    reduce_file = path.join(outdir, 'output.reduce.bam')
+    if output_format == 'cram':
+        reduce_file = path.join(outdir, 'output.reduce.temp.bam')
+    subprocess.run(
+        [
+            'java', '-jar', get_gatk_jar_path(),
+            '-T', 'PrintReads', '-R', genome,
+            '-I', merged_file,
+            '-o', reduce_file,
+            '-dcov', '1', '-U', 'ALLOW_N_CIGAR_READS'
+        ],
+        stdout=f_stdout,
+        stderr=f_stderr)
+    if output_format == 'cram':
+        reduce_cram_file = path.join(outdir, 'output.reduce.cram')
         subprocess.run(
             [
-                'java', '-jar', get_gatk_jar_path(),
-                '-T', 'PrintReads', '-R', args.genome,
-                '-I', path.join(args.outdir, args.name, 'output.bam'),
-                '-o', path.join(args.outdir, args.name, 'output.reduce.bam'),
-                '-dcov', '1', '-U', 'ALLOW_N_CIGAR_READS'
+                'samtools', 'view', '-C', '-T', genome,
+                '-o', reduce_cram_file, reduce_file
             ],
             stdout=f_stdout,
             stderr=f_stderr)
-        print('Finished processing.')
+        subprocess.run(
+            ['samtools', 'index', reduce_cram_file],
+            stdout=f_stdout,
+            stderr=f_stderr)
+        if path.exists(reduce_file):
+            os.remove(reduce_file)
+        if not check_cram_md5(reduce_cram_file, genome):
+            print("The reference MD5s of {} don't match the genome.".format(reduce_cram_file))
+    f_stdout.close()
+    f_stderr.close()
+
+
+if __name__ == '__main__':
+    # parse the arguments, exclude the script name
+    args = parse_args(argv[1:])
+
+    # convert many arguments to absolute path
+    if not path.isabs(args.outdir):
+        args.outdir = path.abspath(args.outdir)
+    if not path.isabs(args.input):
+        args.input = path.abspath(args.input)
+    args.genome = [path.abspath(genome) for genome in args.genome]
+    scratch = None
+    if args.scratch is not None:
+        if not path.isdir(args.scratch):
+            print('Scratch folder {} does not exist.'.format(args.scratch))
+            exit(1)
+        # a folder on the scratch for this invocation, removed when finished
+        scratch = tempfile.mkdtemp(prefix=args.name + '.', dir=path.abspath(args.scratch))
+
+    try:
+        os.mkdir(path.join(args.outdir, args.name))
+        # put the alignments against each genome in a separate folder, if there are many genomes
+        if len(args.genome) == 1:
+            genome_outdirs = [path.join(args.outdir, args.name)]
+        else:
+            genome_names = [get_genome_name(genome) for genome in args.genome]
+            if len(set(genome_names)) != len(genome_names):
+                print('The file names of the genomes should be different.')
+                exit(1)
+            genome_outdirs = [
+                path.join(args.outdir, args.name, genome_name)
+                for genome_name in genome_names
+            ]
+            for genome_outdir in genome_outdirs:
+                os.mkdir(genome_outdir)
+        for ind, genome in enumerate(args.genome):
+            if genome.endswith('.gz'):
+                # cram files need the genome after the scratch is removed, so keep it in the output folder
+                new_genome_file_name = path.join(
+                    scratch if scratch is not None and args.format != 'cram' else genome_outdirs[ind],
+                    path.basename(genome).rstrip('.gz'))
+                with gzip.open(genome, 'rb') as f_in:
+                    with open(new_genome_file_name, 'wb') as f_out:
+                        shutil.copyfileobj(f_in, f_out)
+                args.genome[ind] = new_genome_file_name
+            if args.format == 'cram':
+                # cram files are compressed against the genome, which needs the dict and index first
+                prepare_ref_files(args.genome[ind])
+        # build the HISAT2 index of each genome, on the scratch if there is enough space
+        index_prefixes = []
+        for genome, genome_outdir in zip(args.genome, genome_outdirs):
+            if scratch is not None and check_index_space(scratch, genome):
+                index_dir = tempfile.mkdtemp(prefix=get_genome_name(genome) + '.', dir=scratch)
+            else:
+                index_dir = genome_outdir
+            index_prefixes.append(build_index(genome, index_dir, genome_outdir))
+
+        with open(args.input) as f:
+            col_names = f.readline().rstrip('\n').split('\t')
+            run_ind = col_names.index('Run')
+            platform_ind = col_names.index('Platform')
+            model_ind = col_names.index('Model')
+            layout_ind = col_names.index('LibraryLayout')
+            download_ind = col_names.index('download_path')
+            print('Checking the input tsv file: {}'.format(args.input))
+            for ind, name in zip([run_ind, platform_ind, model_ind, layout_ind, download_ind],
+                                 ['Run', 'Platform', 'Model', 'LibraryLayout', 'download_path']):
+                if ind == -1:
+                    print('{} column is missing in input tsv file.'.format(name))
+                    exit(1)
+            runs = []
+            platforms = []
+            models = []
+            layouts = []
+            download_links = []
+            for line in f:
+                temp = line.rstrip('\n').split('\t')
+                runs.append(temp[run_ind])
+                platforms.append(temp[platform_ind])
+                models.append(temp[model_ind])
+                layouts.append(temp[layout_ind])
+                download_links.append(temp[download_ind])
+        files_for_merge = [[] for _ in args.genome]
+        for run, platform, model, layout, download_link in zip(runs, platforms, models, layouts, download_links):
+            print('Processing the file: {}'.format(run))
+            if not path.isabs(run):
+                run = path.abspath(run)
+            run_file_name = path.basename(run)
+            results = run_pipeline(
+                file=run,
+                genomes=args.genome,
+                index_prefixes=index_prefixes,
+                outdir=path.join(args.outdir, args.name),
+                name=run_file_name,
+                layout=layout,
+                platform=platform,
+                model=model,
+                download_link=download_link,
+                scratch=scratch,
+                output_format=args.format,
+                genome_outdirs=genome_outdirs
+                )
+            for ind, (return_status, err_message) in enumerate(results):
+                if return_status:
+                    files_for_merge[ind].append(
+                        path.join(genome_outdirs[ind], run_file_name, 'output.' + args.format))
+            # errors of the reads preparation are the same for every genome
+            for err_message in sorted(set(err_message for return_status, err_message in results if not return_status)):
+                print(err_message)
+        for genome, genome_outdir, files in zip(args.genome, genome_outdirs, files_for_merge):
+            # combine the sam files together and convert to BAM (or CRAM) file
+            merge_files(files, genome_outdir, genome=genome, output_format=args.format)
+            # handle the downsample
+            if args.downsample:
+                downsample_file(genome_outdir, genome, output_format=args.format)
+    finally:
+        # remove the scratch files, even if one of the steps raised an error
+        if scratch is not None:
+            shutil.rmtree(scratch)
+    print('Finished processing.')
@@ -6,12 +6,16 @@ import sys
 def parse_args(argv):
     parser = argparse.ArgumentParser(description='Easy to use pipeline built for large-scale RNA-seq mapping with a genome assembly')
     parser.add_argument('-i', '--input', dest='input', type=str, help="A tsv file with a list of SRA runs' information.")
-    parser.add_argument('-g', '--genome', dest='genome', help='A fasta file to align with.')
+    parser.add_argument('-g', '--genome', dest='genome', nargs='+', help='One or more fasta files to align with.')
     parser.add_argument('-n', '--name', nargs='?',
                         default=datetime.datetime.now().strftime("%Y-%m-%d-%H-%M-%S"),
                         help='name of the output folder, if not specified, use the time of start')
     parser.add_argument('-o', '--outdir', dest='outdir', nargs='?', default='.',
                         help='directory of output folder at, if not specified, use current folder')
     parser.add_argument('-d', '--downsample', dest='downsample', default=False,action='store_true', help='if specified, a downsampled bam file will be downsampled')
+    parser.add_argument('-s', '--scratch', dest='scratch', default=None,
+                        help='directory on a node-local disk (e.g. $TMPDIR) for intermediate files, if specified, only the final outputs are copied to the output folder')
+    parser.add_argument('-f', '--format', dest='format', default='bam', choices=['bam', 'cram'],
+                        help='format of the output alignments, cram files are compressed against the genome, if not specified, use bam')
     args = parser.parse_args(argv)
     return args
@@ -0,0 +1,212 @@
+import unittest
+import os
+import shutil
+import tempfile
+from collections import namedtuple
+from os import path
+from unittest import mock
+import rnannot.RNAseq_annotate
+from rnannot.RNAseq_annotate import is_published_output, publish_output, read_header_md5s, compare_md5s, get_dict_path, get_genome_name
+
+
+class PublishedOutputTestCase(unittest.TestCase):
+    def test(self):
+        self.assertTrue(is_published_output('output.bam'))
+        self.assertTrue(is_published_output('SRR1_1_fastqc.zip'))
+        self.assertTrue(is_published_output('SRR1.hisat2.errlog'))
+        self.assertFalse(is_published_output('output.sam'))
+        self.assertFalse(is_published_output('output.fastq'))
+
+
+class PublishOutputTestCase(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def test_file(self):
+        src = path.join(self.temp_dir, 'src.log')
+        dst = path.join(self.temp_dir, 'dst.log')
+        with open(src, 'w') as f:
+            f.write('log')
+        publish_output(src, dst)
+        with open(dst) as f:
+            self.assertEqual(f.read(), 'log')
+        self.assertFalse(path.exists(dst + '.part'))
+
+    def test_folder(self):
+        src = path.join(self.temp_dir, 'SRR1_1_fastqc')
+        dst = path.join(self.temp_dir, 'out')
+        os.mkdir(src)
+        os.mkdir(dst)
+        open(path.join(src, 'summary.txt'), 'w').close()
+        publish_output(src, path.join(dst, 'SRR1_1_fastqc'))
+        self.assertTrue(path.exists(path.join(dst, 'SRR1_1_fastqc', 'summary.txt')))
+        self.assertEqual(os.listdir(dst), ['SRR1_1_fastqc'])
+
+
+class ReadHeaderMD5sTestCase(unittest.TestCase):
+    def test(self):
+        lines = [
+            '@HD\tVN:1.6\tSO:coordinate\n',
+            '@SQ\tSN:scaffold1\tLN:1000\tM5:8b1a9953c4611296a827abf8c47804d7\tUR:file:/genome.fa\n',
+            '@SQ\tSN:scaffold2\tLN:500\n',
+            '@PG\tID:samtools\tPN:samtools\n'
+        ]
+        self.assertEqual(read_header_md5s(lines), {'scaffold1': '8b1a9953c4611296a827abf8c47804d7'})
+        self.assertEqual(read_header_md5s([]), {})
+
+
+class CompareMD5sTestCase(unittest.TestCase):
+    def test(self):
+        ref_md5s = {'scaffold1': 'aaa', 'scaffold2': 'bbb'}
+        self.assertTrue(compare_md5s({'scaffold1': 'aaa'}, ref_md5s))
+        self.assertTrue(compare_md5s(ref_md5s, ref_md5s))
+        self.assertFalse(compare_md5s({'scaffold1': 'bbb'}, ref_md5s))
+        self.assertFalse(compare_md5s({'scaffold3': 'aaa'}, ref_md5s))
+        self.assertFalse(compare_md5s({}, ref_md5s))
+
+
+class DictPathTestCase(unittest.TestCase):
+    def test(self):
+        self.assertEqual(get_dict_path('x.fa'), 'x.dict')
+        self.assertEqual(get_dict_path('/data/genome.fasta'), '/data/genome.dict')
+
+
+class GenomeNameTestCase(unittest.TestCase):
+    def test(self):
+        self.assertEqual(get_genome_name('x.fna.gz'), 'x')
+        self.assertEqual(get_genome_name('x.fa'), 'x')
+        self.assertEqual(get_genome_name('dir/x.fasta.gz'), 'x')
+
+
+def fake_prepare_reads(file, output_prefix, layout, platform, model):
+    for file_name in ['SRR1_1.fastq', 'output.fastq', 'SRR1_1_fastqc.zip', 'SRR1.trimmomatic.log']:
+        open(path.join(output_prefix, file_name), 'w').close()
+    os.mkdir(path.join(output_prefix, 'SRR1_1_fastqc'))
+    return (True, '')
+
+
+def fake_align_reads(file, genome, index_prefix, reads_prefix, output_prefix, layout, output_format='bam'):
+    for file_name in ['output.sam', 'output.bam', 'SRR1.hisat2.errlog']:
+        open(path.join(output_prefix, file_name), 'w').close()
+    return (True, '')
+
+
+def failed_prepare_reads(file, output_prefix, layout, platform, model):
+    open(path.join(output_prefix, 'SRR1.fastq-dump.errlog'), 'w').close()
+    open(path.join(output_prefix, 'output.fastq'), 'w').close()
+    raise FileNotFoundError('SRR1_1_fastqc.zip')
+
+
+class ScratchPipelineTestCase(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.outdir = path.join(self.temp_dir, 'out')
+        self.scratch = path.join(self.temp_dir, 'scratch')
+        os.mkdir(self.outdir)
+        os.mkdir(self.scratch)
+        self.file = path.join(self.temp_dir, 'SRR1')
+        self.genome = path.join(self.temp_dir, 'genome.fa')
+        for file_name in [self.file, self.genome]:
+            with open(file_name, 'w') as f:
+                f.write('ACGT')
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def run_pipeline(self, platform='ILLUMINA'):
+        return rnannot.RNAseq_annotate.run_pipeline(
+            file=self.file, genomes=[self.genome], index_prefixes=[self.genome],
+            outdir=self.outdir, name='SRR1', layout='SINGLE', platform=platform,
+            model='Illumina HiSeq 2000', download_link='', scratch=self.scratch)
+
+    @mock.patch('rnannot.RNAseq_annotate.align_reads', fake_align_reads)
+    @mock.patch('rnannot.RNAseq_annotate.prepare_reads', fake_prepare_reads)
+    def test_publish(self):
+        self.assertEqual(self.run_pipeline(), [(True, '')])
+        self.assertEqual(
+            sorted(os.listdir(path.join(self.outdir, 'SRR1'))),
+            ['SRR1.hisat2.errlog', 'SRR1.trimmomatic.log', 'SRR1_1_fastqc', 'SRR1_1_fastqc.zip', 'output.bam'])
+        self.assertEqual(os.listdir(self.scratch), [])
+
+    @mock.patch('rnannot.RNAseq_annotate.prepare_reads', failed_prepare_reads)
+    def test_exception(self):
+        with self.assertRaises(FileNotFoundError):
+            self.run_pipeline()
+        self.assertEqual(os.listdir(path.join(self.outdir, 'SRR1')), ['SRR1.fastq-dump.errlog'])
+        self.assertEqual(os.listdir(self.scratch), [])
+
+    @mock.patch('rnannot.RNAseq_annotate.prepare_reads')
+    def test_no_space(self, prepare_reads):
+        DiskUsage = namedtuple('DiskUsage', ['total', 'used', 'free'])
+        with mock.patch('shutil.disk_usage', return_value=DiskUsage(100, 100, 0)):
+            self.assertFalse(rnannot.RNAseq_annotate.check_scratch_space(self.scratch, self.file, [self.genome]))
+            (return_status, _), = self.run_pipeline()
+        self.assertFalse(return_status)
+        prepare_reads.assert_not_called()
+        self.assertEqual(os.listdir(self.scratch), [])
+
+    @mock.patch('rnannot.RNAseq_annotate.prepare_reads')
+    def test_abi_solid(self, prepare_reads):
+        os.remove(self.file)
+        with mock.patch('rnannot.RNAseq_annotate.urllib.request.urlretrieve') as urlretrieve:
+            (return_status, _), = self.run_pipeline(platform='ABI_SOLID')
+        self.assertFalse(return_status)
+        urlretrieve.assert_not_called()
+        prepare_reads.assert_not_called()
+
+
+class MultiGenomePipelineTestCase(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.outdir = path.join(self.temp_dir, 'out')
+        self.scratch = path.join(self.temp_dir, 'scratch')
+        os.mkdir(self.scratch)
+        self.genome_outdirs = [path.join(self.outdir, 'g1'), path.join(self.outdir, 'g2')]
+        for genome_outdir in self.genome_outdirs:
+            os.makedirs(genome_outdir)
+        self.file = path.join(self.temp_dir, 'SRR1')
+        self.genomes = [path.join(self.temp_dir, 'g1.fa'), path.join(self.temp_dir, 'g2.fa')]
+        self.index_prefixes = [path.join(self.temp_dir, 'index1'), path.join(self.temp_dir, 'index2')]
+        for file_name in [self.file] + self.genomes:
+            with open(file_name, 'w') as f:
+                f.write('ACGT')
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def run_pipeline(self, scratch):
+        with mock.patch('rnannot.RNAseq_annotate.prepare_reads', side_effect=fake_prepare_reads) as prepare_reads, \
+                mock.patch('rnannot.RNAseq_annotate.align_reads', side_effect=fake_align_reads) as align_reads:
+            results = rnannot.RNAseq_annotate.run_pipeline(
+                file=self.file, genomes=self.genomes, index_prefixes=self.index_prefixes,
+                outdir=self.outdir, name='SRR1', layout='SINGLE', platform='ILLUMINA',
+                model='Illumina HiSeq 2000', download_link='', scratch=scratch,
+                genome_outdirs=self.genome_outdirs)
+        self.assertEqual(results, [(True, ''), (True, '')])
+        # the reads are prepared once, then aligned to each genome
+        self.assertEqual(prepare_reads.call_count, 1)
+        reads_prefix = prepare_reads.call_args[0][1]
+        self.assertEqual(align_reads.call_count, 2)
+        for call, genome, index_prefix in zip(align_reads.call_args_list, self.genomes, self.index_prefixes):
+            self.assertEqual(call[0][1:4], (genome, index_prefix, reads_prefix))
+        self.assertNotEqual(align_reads.call_args_list[0][0][4], align_reads.call_args_list[1][0][4])
+        # the reads preparation outputs go to <name>/<run>, the alignments to <name>/<genome>/<run>
+        self.assertIn('SRR1_1_fastqc.zip', os.listdir(path.join(self.outdir, 'SRR1')))
+        self.assertNotIn('output.bam', os.listdir(path.join(self.outdir, 'SRR1')))
+        for genome_outdir in self.genome_outdirs:
+            self.assertIn('output.bam', os.listdir(path.join(genome_outdir, 'SRR1')))
+        return reads_prefix, [call[0][4] for call in align_reads.call_args_list]
+
+    def test(self):
+        reads_prefix, align_prefixes = self.run_pipeline(None)
+        self.assertEqual(reads_prefix, path.join(self.outdir, 'SRR1'))
+        self.assertEqual(align_prefixes, [path.join(genome_outdir, 'SRR1') for genome_outdir in self.genome_outdirs])
+
+    def test_scratch(self):
+        reads_prefix, align_prefixes = self.run_pipeline(self.scratch)
+        for prefix in [reads_prefix] + align_prefixes:
+            self.assertTrue(prefix.startswith(self.scratch))
+        self.assertEqual(os.listdir(self.scratch), [])
@@ -12,3 +12,27 @@ class ParserTestCase(unittest.TestCase):
             parse_args(['-i', './example/197043.tsv', '-g' ,'../GCA_000696855.1_Hvit_1.0_genomic.fna.gz'])
         except:
             print('Parser erroneously parses the correct command.')
+
+
+class ScratchParserTestCase(unittest.TestCase):
+    def test(self):
+        args = parse_args(['-i', './example/197043.tsv', '-g', '../GCA_000696855.1_Hvit_1.0_genomic.fna.gz', '-s', '/tmp'])
+        self.assertEqual(args.scratch, '/tmp')
+        args = parse_args(['-i', './example/197043.tsv', '-g', '../GCA_000696855.1_Hvit_1.0_genomic.fna.gz'])
+        self.assertIsNone(args.scratch)
+
+
+class FormatParserTestCase(unittest.TestCase):
+    def test(self):
+        args = parse_args(['-i', './example/197043.tsv', '-g', '../GCA_000696855.1_Hvit_1.0_genomic.fna.gz', '-f', 'cram'])
+        self.assertEqual(args.format, 'cram')
+        args = parse_args(['-i', './example/197043.tsv', '-g', '../GCA_000696855.1_Hvit_1.0_genomic.fna.gz'])
+        self.assertEqual(args.format, 'bam')
+
+
+class GenomesParserTestCase(unittest.TestCase):
+    def test(self):
+        args = parse_args(['-g', 'a.fa.gz', 'b.fa'])
+        self.assertEqual(args.genome, ['a.fa.gz', 'b.fa'])
+        args = parse_args(['-g', 'a.fa.gz'])
+        self.assertEqual(args.genome, ['a.fa.gz'])